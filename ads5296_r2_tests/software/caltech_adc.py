@@ -5,6 +5,17 @@ import numpy as np
 import time
 
 
+def _packPatterns(resolution):
+    """ Return the (pattern1, pattern2) pair used for clock alignment
+    at the given resolution
+    """
+    pats = [0b1010101010,0b0101010101,0b0000000000,0b1111111111]
+    mask = (1<<(resolution//2))-1
+    ofst = resolution//2
+    p1 = ((pats[0] & mask) << ofst) + (pats[3] & mask)
+    p2 = ((pats[1] & mask) << ofst) + (pats[2] & mask)
+    return p1, p2
+
 # Some codes and docstrings are copied from https://github.com/UCBerkeleySETI/snap_control
 class CaltechAdc(object):
     # Wishbone address and mask for read
@@ -35,6 +46,24 @@ class CaltechAdc(object):
     M_WB_W_ISERDES_BITSLIP_CHIP_SEL = 0b11111111 << 8
     M_WB_W_ISERDES_BITSLIP_LANE_SEL = 0b111 << 5
 
+    # Precompiled (unsigned, signed) formats used by _signed, keyed by width
+    S_SIGNED = {8  : (struct.Struct('!B'), struct.Struct('!b')),
+                16 : (struct.Struct('!H'), struct.Struct('!h')),
+                32 : (struct.Struct('!I'), struct.Struct('!i')),}
+
+    # Precompiled big-endian formats for n-word controller writes, keyed by n
+    S_RUN = {}
+
+    # Clock alignment test patterns (pattern1, pattern2), keyed by resolution
+    PATS = {8  : _packPatterns(8),
+            10 : _packPatterns(10),}
+
+    # Seconds for which a register value read by getWord() may be reused
+    REG_CACHE_TTL = 0.1
+    # Word 0 is written directly by the 3-wire SPI driver (self.adc) and holds
+    # live status such as ADC16_LOCKED, so it is never cached
+    R_WB_UNCACHED = frozenset([0b00 << 2])
+
     def __init__(self, interface, **kwargs):
         self.RESOLUTION  = 8
         self.adc = None
@@ -49,7 +78,9 @@ class CaltechAdc(object):
         
         # interface => casperfpga.CasperFpga(hostname/ip)
 
-        self.A_WB_R_LIST = [self.WB_DICT.index(a) for a in self.WB_DICT if a != None]
+        self.A_WB_R_LIST = [i for i, a in enumerate(self.WB_DICT) if a is not None]
+        # Map each register field name to the address of the word holding it
+        self._name_to_rid = {name: rid for rid in self.A_WB_R_LIST for name in self.WB_DICT[rid]}
         self.adcList = [0, 1, 2, 3]
         self.snapList = ['adc_snapshot0', 'adc_snapshot1', 'adc_snapshot2', 'adc_snapshot3']
         self.snapWidthList = [10, 8, 10, 8]
@@ -58,18 +89,22 @@ class CaltechAdc(object):
 
         self.laneList = [0, 1, 2, 3, 4, 5, 6, 7]
 
+        # For validating chip and lane selections
+        self._adcSet = frozenset(self.adcList)
+        self._laneSet = frozenset(self.laneList)
+
         self.curDelay = np.zeros((len(self.adcList),len(self.laneList)))
 
+        # Recently read register values, {rid: (read time, value)}.
+        # Cleared by _write_run(). Words in R_WB_UNCACHED are never stored.
+        self._regCache = {}
+
         self.ram = [WishBoneDevice(interface,name) for name in self.ramList]
 
         self.adc = HMCAD1511(interface,'adc16_controller')
 
         # test pattern for clock aligning
-        pats = [0b10101010,0b01010101,0b00000000,0b11111111]
-        mask = (1<<(self.RESOLUTION/2))-1
-        ofst = self.RESOLUTION/2
-        self.p1 = ((pats[0] & mask) << ofst) + (pats[3] & mask)
-        self.p2 = ((pats[1] & mask) << ofst) + (pats[2] & mask)
+        self.p1, self.p2 = self.PATS[self.RESOLUTION]
 
     def init(self, samplingRate=250, numChannel=4):
         """ Get SNAP ADCs into working condition
@@ -178,11 +213,11 @@ class CaltechAdc(object):
         """
 
         # csn active low for HMCAD1511, but inverted in wb_adc16_controller
+        # Chip select bits are distinct powers of two, so summing them ORs them
         if chipSel==None:       # Select all ADC chips
-            self.adc.cs = np.bitwise_or.reduce([0b1 << s for s in self.adcList])
-        elif isinstance(chipSel, list) and all(s in self.adcList for s in chipSel):
-            csList = [0b1 << s for s in self.adcList if s in chipSel]
-            self.adc.cs = np.bitwise_or.reduce(csList)
+            self.adc.cs = sum(0b1 << s for s in self.adcList)
+        elif isinstance(chipSel, list) and self._adcSet.issuperset(chipSel):
+            self.adc.cs = sum(0b1 << s for s in self.adcList if s in chipSel)
         elif chipSel in self.adcList:
             self.adc.cs = 0b1 << chipSel
         else:
@@ -203,27 +238,28 @@ class CaltechAdc(object):
         mode = modeMap[numChannel]
         val = self._set(0x0, mode,  self.M_WB_W_DEMUX_MODE)
         val = self._set(val, 0b1,   self.M_WB_W_DEMUX_WRITE)
-        self.adc._write(val, self.A_WB_W_CTRL)
+        self._write_batch([(val, self.A_WB_W_CTRL)])
 
     def reset(self):
         """ Reset all adc16_interface logics inside FPGA """
         val = self._set(0x0, 0x1,   self.M_WB_W_RESET)
-        self.adc._write(0x0, self.A_WB_W_CTRL)
-        self.adc._write(val, self.A_WB_W_CTRL)
-        self.adc._write(0x0, self.A_WB_W_CTRL)
+        self._write_batch([(0x0, self.A_WB_W_CTRL),
+                           (val, self.A_WB_W_CTRL),
+                           (0x0, self.A_WB_W_CTRL)])
 
     def snapshot(self):
         """ Save 1024 consecutive samples of each ADC into its corresponding bram """
+        # Arm every snapshot block, then trigger them all with one request
         for ram in self.snapCtrlList:
             self.interface.write_int(ram, 0b100, blindwrite=True)
             self.interface.write_int(ram, 0b101, blindwrite=True) # arm
             self.interface.write_int(ram, 0b100, blindwrite=True)
-            val = self._set(0x0, 0x1,   self.M_WB_W_SNAP_REQ)
-            self.adc._write(0x0, self.A_WB_W_CTRL)
-            self.adc._write(val, self.A_WB_W_CTRL)
-            self.adc._write(0x0, self.A_WB_W_CTRL)
             #self.interface.write_int(ram, 0b110, blindwrite=True) # trigger
             #self.interface.write_int(ram, 0b100, blindwrite=True)
+        val = self._set(0x0, 0x1,   self.M_WB_W_SNAP_REQ)
+        self._write_batch([(0x0, self.A_WB_W_CTRL),
+                           (val, self.A_WB_W_CTRL),
+                           (0x0, self.A_WB_W_CTRL)])
 
     def calibrateAdcOffset(self):
 
@@ -237,13 +273,46 @@ class CaltechAdc(object):
         
     def getRegister(self, rid=None):
         if rid==None:
-            return [self.getRegister(regId) for regId in self.A_WB_R_LIST]
+            rvals = self._readAllRegs()
+            return [{name: self._get(rvals[regId],mask) for name, mask in self.WB_DICT[regId].items()}
+                    for regId in self.A_WB_R_LIST]
         elif rid in self.A_WB_R_LIST:
             rval = self.adc._read(rid)
             return {name: self._get(rval,mask) for name, mask in self.WB_DICT[rid].items()}
         else:
             raise ValueError("Invalid parameter")
 
+    def _readAllRegs(self):
+        """ Read all controller registers in one burst
+
+        Returns a dict of register values keyed by register id. The burst spans
+        every word up to the highest register id, so it costs one bridge
+        transaction rather than one per register.
+        """
+        nwords = max(self.A_WB_R_LIST) + 1
+        raw = self.adc._read(addr=0, size=nwords*4)
+        words = struct.unpack('>%dI' % nwords, raw)
+        now = time.time()
+        for rid in self.A_WB_R_LIST:
+            if rid not in self.R_WB_UNCACHED:
+                self._regCache[rid] = (now, words[rid])
+        return {rid: words[rid] for rid in self.A_WB_R_LIST}
+
+    def _cachedRead(self, rid):
+        """ Read a register, reusing a value read within REG_CACHE_TTL seconds """
+        now = time.time()
+        if rid in self._regCache:
+            t, rval = self._regCache[rid]
+            if now - t < self.REG_CACHE_TTL:
+                return rval
+        rval = self.adc._read(rid)
+        if rid not in self.R_WB_UNCACHED:
+            self._regCache[rid] = (now, rval)
+        return rval
+
+    def _invalidateRegCache(self):
+        self._regCache = {}
+
     def _get(self, data, mask):
         data = data & mask
         return data / (mask & -mask)
@@ -255,17 +324,45 @@ class CaltechAdc(object):
             d2 = d2 * (mask & -mask)
         return d1 | d2
 
+    def _write_batch(self, ops):
+        """ Write a sequence of (value, address) pairs to the controller
+
+        Runs of writes to consecutive word addresses are merged into a single
+        burst, so each run costs one bridge transaction rather than one per
+        word. Every write is issued, in the order given.
+        E.g.
+            _write_batch([(0, 1), (0, 2), (0, 3)])  # one 12-byte burst
+            _write_batch([(0, 1), (1, 1), (0, 1)])  # three single writes
+        """
+        run = []
+        for val, addr in ops:
+            if run and addr != run[-1][1] + 1:
+                self._write_run(run)
+                run = []
+            run.append((val, addr))
+        if run:
+            self._write_run(run)
+
+    def _write_run(self, run):
+        # Pack the words ourselves and blindwrite them, which is all that
+        # write_int(..., blindwrite=True) does for a single word anyway
+        self._invalidateRegCache()
+        n = len(run)
+        if n not in self.S_RUN:
+            self.S_RUN[n] = struct.Struct('>%dI' % n)
+        data = self.S_RUN[n].pack(*[val for val, addr in run])
+        self.interface.blindwrite(self.adc.name, data, offset=run[0][1]*4)
+
     def getWord(self,name):
         rid = self.getRegId(name)
-        rval = self.adc._read(rid)
+        rval = self._cachedRead(rid)
         return self._get(rval,self.WB_DICT[rid][name])
 
     def getRegId(self,name):
-        rid = [d for d in self.A_WB_R_LIST if name in self.WB_DICT[d]]
-        if len(rid) == 0:
+        try:
+            return self._name_to_rid[name]
+        except KeyError:
             raise ValueError("Invalid parameter")
-        else:
-            return rid[0]
 
     def interleave(self,data,mode):
         """ Reorder the data according to the interleaving mode
@@ -289,10 +386,11 @@ class CaltechAdc(object):
         """
         if ram==None:                       # read all RAMs
             return self.readRAM(self.adcList,signed,undo_bitflip)
-        elif isinstance(ram, list) and all(r in self.adcList for r in ram):
+        elif isinstance(ram, list) and self._adcSet.issuperset(ram):
                                     # read a list of RAMs
-            data = [self.readRAM(r,signed,undo_bitflip) for r in ram if r in self.adcList]
-            return dict(zip(ram,data))
+            # Read one RAM at a time: all reads go through the same bridge
+            # client, which is not safe to use from several threads
+            return {r: self.readRAM(r,signed,undo_bitflip) for r in ram}
         elif ram in self.adcList:               # read one RAM      
             #if self.snapWidthList[ram]>8:       # ADC_DATA_WIDTH == 16
             #    fmt = '!1024' + ('h' if signed else 'H')
@@ -302,20 +400,30 @@ class CaltechAdc(object):
             #    length = 1024
             #vals = self.ram[ram]._read(addr=0, size=length)
             #vals = np.array(struct.unpack(fmt,vals)).reshape(-1,8)
-            if self.snapWidthList[ram]>8:       # ADC_DATA_WIDTH == 16
-                fmt = '>1024H'
+            res = self.snapWidthList[ram]
+            half = 1 << (res - 1)
+            if res>8:       # ADC_DATA_WIDTH == 16
+                dtype = np.dtype('>u2')
                 length = 2048
-                shift = 16 - self.snapWidthList[ram]
+                shift = 16 - res
             else:               # ADC_DATA_WIDTH == 8
-                fmt = '>1024B'
+                dtype = np.dtype('>u1')
                 length = 1024
                 shift = 0
             vals = self.ram[ram]._read(addr=0, size=length)
-            vals = np.array(struct.unpack(fmt,vals)).reshape(-1,8) >> shift
-            if undo_bitflip:
-                vals = vals ^ (1<<(self.snapWidthList[ram] - 1)) # undo MSB inversion (which the firmware does)
+            # astype() gives us a private int32 copy, so everything after it
+            # can be done in place without further allocations
+            vals = np.frombuffer(vals, dtype=dtype).astype(np.int32).reshape(-1,8)
+            if shift:
+                vals >>= shift
+            # undo_bitflip undoes the MSB inversion (which the firmware does).
+            # Sign extension is (x ^ half) - half, so the two MSB flips can
+            # be merged into one.
+            flip = (half if undo_bitflip else 0) ^ (half if signed else 0)
+            if flip:
+                vals ^= flip
             if signed:
-                vals[vals>(2**(self.snapWidthList[ram]-1))] -= 2**self.snapWidthList[ram]
+                vals -= half
             return vals
         else:
             raise ValueError("Invalid parameter")
@@ -355,7 +463,7 @@ class CaltechAdc(object):
 
         if not isinstance(chipSel,list):
             raise ValueError("Invalid parameter")
-        elif isinstance(chipSel,list) and any(cs not in self.adcList for cs in chipSel):
+        elif isinstance(chipSel,list) and not self._adcSet.issuperset(chipSel):
             raise ValueError("Invalid parameter")
 
         if laneSel == None:
@@ -365,23 +473,28 @@ class CaltechAdc(object):
 
         if not isinstance(laneSel,list):
             raise ValueError("Invalid parameter")
-        elif isinstance(laneSel,list) and any(cs not in self.laneList for cs in laneSel):
+        elif isinstance(laneSel,list) and not self._laneSet.issuperset(laneSel):
             raise ValueError("Invalid parameter")
 
         self.logger.debug('Bitslip lane {0} of chip {1}'.format(str(laneSel),str(chipSel)))
 
+        # The chip select field is a bitmask, so all selected chips can be
+        # slipped with one command per lane
+        csMask = 0
         for cs in chipSel:
-            for ls in laneSel:
-                val = self._set(0x0, 0b1 << cs, self.M_WB_W_ISERDES_BITSLIP_CHIP_SEL)
-                val = self._set(val, ls, self.M_WB_W_ISERDES_BITSLIP_LANE_SEL)
-        
-                # The registers related to reset, request, bitslip, and other
-                # commands after being set will not be automatically cleared.  
-                # Therefore we have to clear them by ourselves.
-        
-                self.adc._write(0x0, self.A_WB_W_CTRL)  
-                self.adc._write(val, self.A_WB_W_CTRL)  
-                self.adc._write(0x0, self.A_WB_W_CTRL)  
+            csMask |= 0b1 << cs
+
+        for ls in laneSel:
+            val = self._set(0x0, csMask, self.M_WB_W_ISERDES_BITSLIP_CHIP_SEL)
+            val = self._set(val, ls, self.M_WB_W_ISERDES_BITSLIP_LANE_SEL)
+
+            # The registers related to reset, request, bitslip, and other
+            # commands after being set will not be automatically cleared.
+            # Therefore we have to clear them by ourselves.
+
+            self._write_batch([(0x0, self.A_WB_W_CTRL),
+                               (val, self.A_WB_W_CTRL),
+                               (0x0, self.A_WB_W_CTRL)])
 
 
     # The ADC16 controller word (the offset in write_int method) 2 and 3 are for delaying 
@@ -404,14 +517,14 @@ class CaltechAdc(object):
             chipSel = self.adcList
         elif chipSel in self.adcList:
             chipSel = [chipSel]
-        elif isinstance(chipSel, list) and any(s not in self.adcList for s in chipSel):
+        elif isinstance(chipSel, list) and not self._adcSet.issuperset(chipSel):
             raise ValueError("Invalid parameter")
 
         if laneSel==None:
             laneSel = self.laneList
         elif laneSel in self.laneList:
             laneSel = [laneSel]
-        elif isinstance(laneSel,list) and any(s not in self.laneList for s in laneSel):
+        elif isinstance(laneSel,list) and not self._laneSet.issuperset(laneSel):
             raise ValueError("Invalid parameter")
         elif laneSel not in self.laneList:
             raise ValueError("Invalid parameter")
@@ -424,41 +537,34 @@ class CaltechAdc(object):
         self.logger.debug('Set DelayTap of lane {0} of chip {1} to {2}'
                 .format(str(laneSel),str(chipSel),tap))
 
-        matc = np.array([(cs*4) for cs in chipSel])
-
-        matla = np.array([int(l/2) for l in laneSel if l%2==0])
-        if matla.size:
-            mata =  np.repeat(matc.reshape(-1,1),matla.size,1) + \
-                np.repeat(matla.reshape(1,-1),matc.size,0)
-            vala = np.bitwise_or.reduce([0b1 << s for s in mata.flat])
-        else:
-            vala = 0
-        
-        matlb = np.array([int(l/2) for l in laneSel if l%2==1])
-        if matlb.size:
-            matb =  np.repeat(matc.reshape(-1,1),matlb.size,1) + \
-                np.repeat(matlb.reshape(1,-1),matc.size,0)
-            valb = np.bitwise_or.reduce([0b1 << s for s in matb.flat])
-        else:
-            valb = 0
+        # Each chip owns 4 bits of each strobe word; even lanes live in the
+        # A (low) word and odd lanes in the B (high) word
+        evenLanes = [l >> 1 for l in laneSel if l%2==0]
+        oddLanes = [l >> 1 for l in laneSel if l%2==1]
+        vala = 0
+        valb = 0
+        for cs in chipSel:
+            base = cs*4
+            for l in evenLanes:
+                vala |= 0b1 << (base + l)
+            for l in oddLanes:
+                valb |= 0b1 << (base + l)
 
         valt = self._set(0x0, tap, self.M_WB_W_DELAY_TAP)
 
         # Don't be misled by the naming - "DELAY_STROBE" in casper repo.  It doesn't 
         # generate strobe at all.  You have to manually clear the bits that you set.
-        self.adc._write(0x00, self.A_WB_W_CTRL)
-        self.adc._write(0x00, self.A_WB_W_DELAY_STROBE_L)
-        self.adc._write(0x00, self.A_WB_W_DELAY_STROBE_H)
-        self.adc._write(valt, self.A_WB_W_CTRL)
-        self.adc._write(vala, self.A_WB_W_DELAY_STROBE_L)
-        self.adc._write(valb, self.A_WB_W_DELAY_STROBE_H)
-        self.adc._write(0x00, self.A_WB_W_CTRL)
-        self.adc._write(0x00, self.A_WB_W_DELAY_STROBE_L)
-        self.adc._write(0x00, self.A_WB_W_DELAY_STROBE_H)
+        self._write_batch([(0x00, self.A_WB_W_CTRL),
+                           (0x00, self.A_WB_W_DELAY_STROBE_L),
+                           (0x00, self.A_WB_W_DELAY_STROBE_H),
+                           (valt, self.A_WB_W_CTRL),
+                           (vala, self.A_WB_W_DELAY_STROBE_L),
+                           (valb, self.A_WB_W_DELAY_STROBE_H),
+                           (0x00, self.A_WB_W_CTRL),
+                           (0x00, self.A_WB_W_DELAY_STROBE_L),
+                           (0x00, self.A_WB_W_DELAY_STROBE_H)])
 
-        for cs in chipSel:
-            for ls in laneSel:
-                self.curDelay[cs,ls] = tap
+        self.curDelay[np.ix_(chipSel, laneSel)] = tap
 
 
     def testPatterns(self, chipSel=None, taps=None, mode='std', pattern1=None, pattern2=None):
@@ -549,7 +655,7 @@ class CaltechAdc(object):
             chipSel = [chipSel]
         if not isinstance(chipSel,list):
             raise ValueError("Invalid parameter")
-        elif isinstance(chipSel,list) and any(cs not in self.adcList for cs in chipSel):
+        elif isinstance(chipSel,list) and not self._adcSet.issuperset(chipSel):
             raise ValueError("Invalid parameter")
 
         if taps==True:
@@ -566,52 +672,30 @@ class CaltechAdc(object):
 
         self.selectADC(chipSel)
         if mode=='ramp':        # ramp mode
-            for adc in chipSel:
-                self.selectADC(adc)
-                if adc%2 == 0:
-                    self.adc.test_ads('en_ramp')
-                else:
-                    self.adc.test('en_ramp')
+            self._setTestMode(chipSel, 'en_ramp')
             taps=None
             pattern1=None
             pattern2=None
         elif pattern1==None and pattern2==None:
-            for adc in chipSel:
-                self.selectADC(adc)
-                resolution = self.snapWidthList[adc]
-                if adc%2 == 0:
-                    # synchronization mode
-                    self.adc.test_ads('pat_sync')
-                else:
-                    # synchronization mode
-                    self.adc.test('pat_sync')
+            resolution = self.snapWidthList[chipSel[-1]]
+            # synchronization mode
+            self._setTestMode(chipSel, 'pat_sync')
             # pattern1 = 0b11110000 when self.RESOLUTION is 8
             # pattern1 = 0b111111000000 when self.RESOLUTION is 12
-            pattern1 = ((2**(resolution/2))-1) << (resolution/2)
+            pattern1 = ((1 << (resolution//2))-1) << (resolution//2)
             pattern1 = self._signed(pattern1,resolution)
         elif isinstance(pattern1,int) and pattern2==None:
             # single pattern mode
             reg_p1 = pattern1
-            for adc in chipSel:
-                self.selectADC(adc)
-                resolution = self.snapWidthList[adc]
-                if adc%2 == 0:
-                    self.adc.test_ads('single_custom_pat',reg_p1)
-                else:
-                    self.adc.test('single_custom_pat',reg_p1)
+            resolution = self.snapWidthList[chipSel[-1]]
+            self._setTestMode(chipSel, 'single_custom_pat', reg_p1)
             pattern1 = self._signed(pattern1,resolution)
         elif isinstance(pattern1,int) and isinstance(pattern2,int):
             # dual pattern mode
             reg_p1 = pattern1
             reg_p2 = pattern2
-            for adc in chipSel:
-                self.selectADC(adc)
-                resolution = self.snapWidthList[adc]
-                if adc%2 == 0:
-                    self.adc.test_ads('dual_custom_pat',reg_p1,reg_p2)
-                else:
-                    self.adc.test('dual_custom_pat',reg_p1,reg_p2)
-
+            resolution = self.snapWidthList[chipSel[-1]]
+            self._setTestMode(chipSel, 'dual_custom_pat', reg_p1, reg_p2)
 
             pattern1 = self._signed(pattern1,resolution)
             pattern2 = self._signed(pattern2,resolution)
@@ -620,33 +704,43 @@ class CaltechAdc(object):
 
         results = []
 
+        if mode=='err' and pattern2!=None:
+            # Expected data for both orderings of the alternating patterns,
+            # since a snapshot may start on either one
+            m1 = np.empty((1024//len(self.laneList), len(self.laneList)), dtype=np.int32)
+            m2 = np.empty_like(m1)
+            m1[0::2,:],m1[1::2,:]=pattern1,pattern2
+            m2[0::2,:],m2[1::2,:]=pattern2,pattern1
+
         def _check(data):
-            d = np.array(data).reshape(-1, 8)
+            d = np.asarray(data).reshape(-1, 8)
             if mode=='std' and pattern2==None:  # std mode, single pattern
                 r = np.std(d,0)
             elif mode=='std' and pattern2!=None:    # std mode, dual patterns
-                counts = [np.unique(d[:,i],return_counts=True)[1] for i in range(d.shape[1])]
-                r = [np.sum(np.sort(count)[::-1][2:]) for count in counts]
+                # Count everything except the two most common values
+                counts = self._countColumns(d)
+                r = np.sort(counts,1)[:,:-2].sum(1)
             elif mode=='err' and pattern2==None:    # err mode, single pattern
                 #print pattern1, d
                 r = np.sum(d!=pattern1, 0)
             elif mode=='err' and pattern2!=None:    # err mode, dual pattern
                 # Try two patterns with different order, and return the
                 # result
-                m1,m2 = np.zeros(d.shape),np.zeros(d.shape)
-                #print d, pattern1, pattern2
-                m1[0::2,:],m1[1::2,:]=pattern1,pattern2
-                m2[0::2,:],m2[1::2,:]=pattern2,pattern1
                 r=np.minimum(np.sum(d!=m1,0),np.sum(d!=m2,0))
             elif mode=='ramp':          # ramp mode
                 diff = d[1:,:]-d[:-1,:]
-                counts=[np.unique(diff[:,ls],return_counts=True)[1] for ls in self.laneList]
-                r = [d.shape[0]-1-sum(counts[ls][:2]) for ls in self.laneList]
+                # Count the two smallest step sizes seen in each lane (the
+                # wrap-around and the +1 step of a good ramp) as correct
+                counts = self._countColumns(diff)
+                seen = counts > 0
+                first2 = seen & (np.cumsum(seen,1) <= 2)
+                r = d.shape[0]-1-(counts*first2).sum(1)
             return r
 
         if taps == None:
             self.snapshot()
-            results = [_check(self.readRAM(cs)) for cs in chipSel]
+            data = self.readRAM(chipSel)
+            results = [_check(data[cs]) for cs in chipSel]
             results = np.array(results).reshape(len(chipSel),len(self.laneList)).tolist()
             results = dict(zip(chipSel,results))
             for cs in chipSel:
@@ -655,26 +749,50 @@ class CaltechAdc(object):
             for tap in taps:
                 self.delay(tap, chipSel)
                 self.snapshot()
-                results += [_check(self.readRAM(cs)) for cs in chipSel]
+                data = self.readRAM(chipSel)
+                results += [_check(data[cs]) for cs in chipSel]
             results = np.array(results).reshape(-1,len(chipSel),len(self.laneList))
-            results = np.einsum('ijk->jik',results).tolist()
+            results = results.transpose(1,0,2).tolist()
             results = dict(zip(chipSel,results))
             for cs in chipSel:
                 results[cs] = dict(zip(taps,[np.array(row) for row in results[cs]]))
         
         
-        for adc in chipSel:
-            self.selectADC(adc)
-            if adc%2 == 0:
-                self.adc.test_ads('off')
-            else:
-                self.adc.test('off')
+        self._setTestMode(chipSel, 'off')
 
         if len(chipSel) == 1:
             return results[chipSel[0]]
         else:
             return results
 
+    def _countColumns(self, d):
+        """ Histogram each column of a 2D integer array
+
+        Returns a (columns, bins) array of counts, with bins in ascending
+        value order starting at the array's minimum. All columns are counted
+        in a single np.bincount call.
+        """
+        d = d - d.min()
+        nbins = d.max() + 1
+        idx = d + nbins*np.arange(d.shape[1])
+        return np.bincount(idx.ravel(), minlength=nbins*d.shape[1]).reshape(d.shape[1], nbins)
+
+    def _setTestMode(self, chipSel, mode, *pats):
+        """ Put a list of ADCs into a test mode
+
+        Even-numbered chips are ADS5296s and odd-numbered chips are HMCAD1511s.
+        Chips of the same type are selected together, so each test mode command
+        is sent over the 3-wire bus at most once per chip type.
+        """
+        ads = [adc for adc in chipSel if adc%2 == 0]
+        hmc = [adc for adc in chipSel if adc%2 == 1]
+        if ads:
+            self.selectADC(ads)
+            self.adc.test_ads(mode, *pats)
+        if hmc:
+            self.selectADC(hmc)
+            self.adc.test(mode, *pats)
+
     def _signed(self, data, res=8):
         """ Convert unsigned number to signed number
 
@@ -701,16 +819,8 @@ class CaltechAdc(object):
         else:
             offset = (1<<width)-(1<<res-1)
             data = data + offset
-            if width == 8:
-                data = struct.pack('!B',data)
-                data = struct.unpack('!b',data)
-            elif width == 16:
-                data = struct.pack('!H',data)
-                data = struct.unpack('!h',data)
-            else:   # width == 32
-                data = struct.pack('!I',data)
-                data = struct.unpack('!i',data)
-            return data[0]
+            unsignedFmt, signedFmt = self.S_SIGNED[width]
+            return signedFmt.unpack(unsignedFmt.pack(data))[0]
         
 
     def decideDelay(self, data):
@@ -722,36 +832,37 @@ class CaltechAdc(object):
         the delay tap setting
         """
 
-        if not isinstance(data,np.ndarray):
-            raise ValueError("Invalid parameter")
-        elif data.ndim==1:
-            data = data.reshape(-1,1)
-        elif data.ndim>2:
+        data = np.asarray(data)
+        if data.ndim>2:
             raise ValueError("Invalid parameter")
+        elif data.ndim==2:
+            data = data.sum(1)
 
-        data = np.sum(data,1)
-
-        if all(d != 0 for d in data):
+        data = data.ravel().tolist()
+        if all(data):
             return False
-            
-        dist=np.zeros(data.shape)
-        curDist = 0
-        for i in range(data.size):
-            if data[i] != 0:
-                curDist = 0
-            else:
-                curDist += 1
-            dist[i] = curDist
-        curDist = 0
-        for i in list(reversed(range(data.size))):
+
+        # Distance from each tap back to the nearest non-zero tap before it
+        fwd = []
+        last = -1
+        for i, v in enumerate(data):
+            if v != 0:
+                last = i
+            fwd.append(i - last)
+
+        # Walk back down the taps, measuring the distance to the nearest
+        # non-zero tap after each one and keeping the tap furthest from
+        # either. Ties go to the lowest tap.
+        best, bestDist = 0, -1
+        nxt = len(data)
+        for i in range(len(data)-1, -1, -1):
             if data[i] != 0:
-                curDist = 0
-            else:
-                curDist += 1
-            if dist[i] > curDist:
-                dist[i] = curDist
+                nxt = i
+            dist = min(fwd[i], nxt - i)
+            if dist >= bestDist:
+                best, bestDist = i, dist
 
-        return np.argmax(dist)
+        return best
 
     # Line clock also known as bit clock in ADC datasheets
     def alignLineClock(self, mode='dual_pat'):
@@ -771,8 +882,9 @@ class CaltechAdc(object):
             # Decide lane-wise delay tap under single pattern test mode
             stds = self.testPatterns(taps=True) # Sweep tap settings and get std
             for adc in self.adcList:
+                stdsAdc = np.array(list(stds[adc].values()))   # taps x lanes
                 for lane in self.laneList:
-                    vals = np.array(stds[adc].values())[:,lane]
+                    vals = stdsAdc[:,lane]
                     t = self.decideDelay(vals)  # Find a proper tap setting 
                     if not t:
                         self.logger.error("ADC{0} lane{1} delay decision failed".format(adc,lane))
@@ -797,20 +909,16 @@ class CaltechAdc(object):
 
             for adc in self.adcList:
                 allDone = True
-                resolution = self.snapWidthList[adc]
-                pats = [0b1010101010,0b0101010101,0b0000000000,0b1111111111]
-                mask = (1<<(resolution/2))-1
-                ofst = resolution/2
-                p1 = ((pats[0] & mask) << ofst) + (pats[3] & mask)
-                p2 = ((pats[1] & mask) << ofst) + (pats[2] & mask)
+                p1, p2 = self.PATS[self.snapWidthList[adc]]
                 #p1 = 0xaaaa & ((2**resolution)-1)
                 #p2 = p1
                 #print("adc %d writing pattern %x, %x" % (adc, p1, p2))
                 errs = self.testPatterns(chipSel=adc, taps=True,mode='std',pattern1=p1,
                         pattern2=p2)
                 #errs = self.testPatterns(chipSel=adc, taps=True,mode='err',pattern1=p1)
+                errs = np.array(list(errs.values()))    # taps x lanes
                 for lane in self.laneList:
-                    vals = np.array(errs.values())[:,lane]
+                    vals = errs[:,lane]
                     #print("adc %d, lane %d" % (adc, lane))
                     #print vals
                     t = self.decideDelay(vals)  # Find a proper tap setting 
@@ -824,7 +932,7 @@ class CaltechAdc(object):
 
     def isLineClockAligned(self):
         errs = self.testPatterns(mode='std',pattern1=self.p1,pattern2=self.p2)
-        if np.all(np.array([adc.values() for adc in errs.values()])==0):
+        if not any(v for adc in errs.values() for v in adc.values()):
             return True
         else:
             self.logger.debug('Line clock NOT aligned.\n{0}'.format(str(errs)))
@@ -836,36 +944,26 @@ class CaltechAdc(object):
 
         for adc in self.adcList:
             resolution = self.snapWidthList[adc]
-            pats = [0b1010101010,0b0101010101,0b0000000000,0b1111111111]
-            mask = (1<<(resolution/2))-1
-            ofst = resolution/2
-            p1 = ((pats[0] & mask) << ofst) + (pats[3] & mask)
-            p2 = ((pats[1] & mask) << ofst) + (pats[2] & mask)
+            p1, p2 = self.PATS[resolution]
             self.logger.info("adc %d writing pattern %x, %x" % (adc, p1, p2))
+            # Lanes which have already returned the expected pattern, and
+            # so must not be slipped again
+            done = np.zeros(len(self.laneList), dtype=bool)
             for u in range(resolution*2):
-	        allDone = True
                 errs = self.testPatterns(chipSel=adc, mode='err',pattern1=p1,pattern2=p2)
-                for lane in self.laneList:
-                    #if errs[adc][lane]!=0:
-                    if errs[lane]!=0:
-                        self.logger.info("%d: bitslipping adc %d lane %d" % (u, adc, lane))
-                        self.bitslip(adc,lane)
-                        allDone = False
-                if allDone:
+                done |= [errs[lane]==0 for lane in self.laneList]
+                if done.all():
                     self.logger.info("Completed alignment for adc %d" % adc)
-                    break;
+                    break
+                lanes = [lane for lane, ok in zip(self.laneList, done) if not ok]
+                self.logger.info("%d: bitslipping adc %d lanes %s" % (u, adc, lanes))
+                self.bitslip(adc,lanes)
 
         return self.isFrameClockAligned()
 
     def isFrameClockAligned(self):
         ok = True
         for adc in self.adcList:
-            resolution = self.snapWidthList[adc]
-            pats = [0b1010101010,0b0101010101,0b0000000000,0b1111111111]
-            mask = (1<<(resolution/2))-1
-            ofst = resolution/2
-            p1 = ((pats[0] & mask) << ofst) + (pats[3] & mask)
-            p2 = ((pats[1] & mask) << ofst) + (pats[2] & mask)
             errs = self.testPatterns(chipSel=adc, mode='err',pattern1=self.p1,pattern2=self.p2)
             ok = ok and (all(val==0 for val in errs.values()))
             self.logger.info('Frame clock is aligned? %s' % ok)
@@ -873,7 +971,7 @@ class CaltechAdc(object):
 
     def rampTest(self):
         errs = self.testPatterns(mode='ramp')
-        return np.all(np.array([adc.values() for adc in errs.values()])==0)
+        return not any(v for adc in errs.values() for v in adc.values())
 
     def isLaneBonded(self, bondAllAdcs=False):
         """
@@ -893,11 +991,14 @@ class CaltechAdc(object):
         self.snapshot()
         d = self.readRAM(signed=False)
         ok = True
+        ref = d[self.adcList[0]][0][0]
         for adc in self.adcList:
-            if bondAllAdcs:
-                ok = ok and (np.all(d[adc][0] == d[self.adcList[0]][0][0]))
-            else:
-                ok = ok and (np.all(d[adc][0] == d[adc][0][0]))
+            first = d[adc][0]
+            if not bondAllAdcs:
+                ref = first[0]
+            if not np.all(first == ref):
+                ok = False
+                break
         self.selectADC([0,2])
         self.adc.test_ads("off")
         self.selectADC([1,3])
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 import numpy as np
-import struct
 import time
 import argparse
 
@@ -15,35 +14,54 @@ except:
     print("Couldn't import ADS5296 control library from casperfpga")
     print("Are you using the correct python environment?")
 
-def get_snapshot(a, signed=False):
-    out = np.zeros([8,8,4096//8])
-    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b0)          
-    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b1)
-    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b0)
-    for i in range(8):     
-        x = a.fpga.read('snapshot%d_snapshot_bram' % i, 8192)
-        d = struct.unpack('>4096H', x)
-        v = [xx >> 6 for xx in d]
-        for j in range(8):
-            out[i, j] = v[j::8]
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def _trigger_snapshot(a):
+    """
+    Strobe the snapshot trigger. The writes are blind, since reading each
+    one back would double the number of round trips to the board.
+    """
+    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b0, blindwrite=True)
+    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b1, blindwrite=True)
+    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b0, blindwrite=True)
+
+def _read_snapshot_brams(a):
+    """
+    Return the raw contents of the 8 snapshot BRAMs, in order.
+    The reads are deliberately serial: the TAPCP transport shares one TFTP
+    client per board with no locking, and the SNAP2 TFTP server handles one
+    session at a time, so concurrent reads from one board are not safe.
+    """
+    return [a.fpga.read('snapshot%d_snapshot_bram' % i, 8192) for i in range(8)]
+
+def get_snapshot(a, signed=False, out=None):
+    """
+    Capture and return a [chips x lanes x samples] snapshot.
+    If out is given, the samples are written into it (and it is returned)
+    rather than into a newly allocated array.
+    """
+    if out is None:
+        out = np.empty([8,8,4096//8], dtype=np.int32)
+    _trigger_snapshot(a)
+    for i, x in enumerate(_read_snapshot_brams(a)):
+        v = np.frombuffer(x, dtype='>u2') >> 6
+        out[i] = v.reshape(-1, 8).T
     if signed:
         out[out>511] -= 1024
-    return np.array(out, dtype=np.int32)
+    return out
 
 def get_snapshot_interleaved(a, signed=False):
-    out = np.zeros([32,4096//4])
-    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b0)          
-    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b1)
-    a.fpga.write_int('snapshot0_snapshot_ctrl', 0b0)
-    for i in range(8):     
-        x = a.fpga.read('snapshot%d_snapshot_bram' % i, 8192)
-        d = struct.unpack('>4096H', x)
-        v = [xx >> 6 for xx in d]
-        for j in range(4):
-            out[4*i + j] = v[j::4]
+    out = np.empty([32,4096//4], dtype=np.int32)
+    _trigger_snapshot(a)
+    for i, x in enumerate(_read_snapshot_brams(a)):
+        v = np.frombuffer(x, dtype='>u2') >> 6
+        out[4*i:4*i+4] = v.reshape(-1, 4).T
     if signed:
         out[out>511] -= 1024
-    return np.array(out, dtype=np.int32)
+    return out
 
 def get_data_delays(a, step_size=TAP_STEP_SIZE):
     TEST_VAL = 0b0000010101
@@ -51,8 +69,7 @@ def get_data_delays(a, step_size=TAP_STEP_SIZE):
         a.enable_test_pattern('constant', i, val0=TEST_VAL)
     NTAPS=512
     NSTEPS = NTAPS // step_size
-    d = np.zeros([NSTEPS, 8, 8, 512]) # taps x chips x lanes x samples
-    errs = np.zeros([NSTEPS, 8, 8]) # taps x chips x lanes
+    d = np.empty([NSTEPS, 8, 8, 512], dtype=np.int16) # taps x chips x lanes x samples
     for cs in range(8):
         a.enable_rst_data(range(8), cs)
         a.disable_rst_data(range(8), cs)
@@ -62,11 +79,8 @@ def get_data_delays(a, step_size=TAP_STEP_SIZE):
         print("Scanning delay %d" % delay)
         for cs in range(8):
             a.load_delay_data(delay, range(8), cs)
-        d[dn] = get_snapshot(a)
-    for t in range(NSTEPS):
-        for c in range(8):
-            for l in range(8):
-                errs[t,c,l] = np.count_nonzero(d[t,c,l,:] != TEST_VAL)
+        get_snapshot(a, out=d[dn])
+    errs = (d != TEST_VAL).sum(axis=-1, dtype=np.int32) # taps x chips x lanes
     return errs
 
 def get_errs(a, use_ramp=False):
@@ -76,45 +90,56 @@ def get_errs(a, use_ramp=False):
             a.enable_test_pattern('ramp', i)
         else:
             a.enable_test_pattern('constant', i, val0=TEST_VAL)
-    errs = np.zeros([8, 8]) # taps x chips x lanes
     d = get_snapshot(a)
-    for c in range(8):
-        for l in range(8):
-            if use_ramp:
-                ds = d[c,l]
-                for i in range(1,ds.shape[0]):
-                    if ds[i] != ((ds[i-1] + 1) % 1024):
-                        errs[c,l] += 1
-            else:
-                errs[c,l] = np.count_nonzero(d[c,l,:] != TEST_VAL)
+    if use_ramp:
+        errs = (d[:,:,1:] != (d[:,:,:-1] + 1) % 1024).sum(axis=-1) # chips x lanes
+    else:
+        errs = (d != TEST_VAL).sum(axis=-1) # chips x lanes
     return errs
     
 
-def get_best_delays(errs, step_size=TAP_STEP_SIZE):
+def _best_delay_steps(errs):
+    """
+    For each chip and lane, return the index of the sweep step with the
+    largest number of error-free steps on both sides of it.
+    This is plain scalar code so that it can be compiled by numba.
+    """
     nsteps, nchips, nlanes = errs.shape
-    slack = np.zeros_like(errs)
-    best = np.zeros([nchips, nlanes], dtype=np.int32)
+    best = np.zeros((nchips, nlanes), dtype=np.int32)
+    count_before = np.zeros(nsteps, dtype=np.int32)
+    count_after = np.zeros(nsteps + 1, dtype=np.int32)
     for c in range(nchips):
         for l in range(nlanes):
+            #run length of zeros ending at each slot (slot 0 never counts)
+            for s in range(1, nsteps):
+                if errs[s, c, l] == 0:
+                    count_before[s] = count_before[s-1] + 1
+                else:
+                    count_before[s] = 0
+            #run length of zeros starting at each slot
+            for s in range(nsteps-1, -1, -1):
+                if errs[s, c, l] == 0:
+                    count_after[s] = count_after[s+1] + 1
+                else:
+                    count_after[s] = 0
+            max_slack = -1
             for s in range(nsteps):
-                #count number of zeros before this slot
-                count_before = 0
-                for j in range(s, 0, -1):
-                    if errs[j, c, l] == 0:
-                        count_before += 1
-                    else:
-                        break
-                #count number of zeros after this slot
-                count_after= 0
-                for j in range(s, nsteps, 1):
-                    if errs[j, c, l] == 0:
-                        count_after += 1
-                    else:
-                        break
-                slack[s,c,l] = min(count_before, count_after)
+                slack = min(count_before[s], count_after[s])
+                if slack > max_slack:
+                    max_slack = slack
+                    best[c, l] = s
+    return best
+
+if njit is not None:
+    # Giving the signature compiles the kernel at import, rather than in
+    # the middle of a calibration
+    _best_delay_steps = njit('i4[:,:](i4[:,:,:])', cache=True)(_best_delay_steps)
+
+def get_best_delays(errs, step_size=TAP_STEP_SIZE):
+    nsteps, nchips, nlanes = errs.shape
+    best = _best_delay_steps(np.asarray(errs, dtype=np.int32)) * step_size
     for c in range(nchips):
         for l in range(nlanes):
-            best[c,l] = slack[:,c,l].argmax()*step_size
             print("Chip %d, Lane %d: Best delay: %d" % (c, l, best[c,l]))
     return best
 
@@ -125,8 +150,10 @@ def set_delays(a, delays, step_size=TAP_STEP_SIZE):
         a.disable_rst_data(range(8), cs)
         a.disable_vtc_data(range(8), cs)
     for c in range(nchips):
-        for l in range(nlanes):
-            a.load_delay_data(delays[c,l], [l], c)
+        # One load per distinct delay, covering every lane that uses it
+        for delay in np.unique(delays[c]):
+            lanes = np.flatnonzero(delays[c] == delay).tolist()
+            a.load_delay_data(delay, lanes, c)
     for cs in range(8):
         a.enable_vtc_data(range(8), cs)
 
@@ -274,8 +301,7 @@ if __name__ == "__main__":
     with open(filename, 'w') as fh:
         fh.write("%s\n" % t)
         fh.write("%s\n" % (','.join(map(str, chans))))
-    for i in range(args.n_dumps):
-        print("Capturing %d of %d" % (i+1, args.n_dumps))
-        x = get_snapshot_interleaved(adc, signed=True)
-        with open(filename, 'a') as fh:
+        for i in range(args.n_dumps):
+            print("Capturing %d of %d" % (i+1, args.n_dumps))
+            x = get_snapshot_interleaved(adc, signed=True)
             np.savetxt(fh, x, fmt="%d", delimiter=",")
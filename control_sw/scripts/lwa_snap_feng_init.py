@@ -63,7 +63,8 @@ def main():
         'config_time' : corr.config_time,
         'config_time_str' : corr.config_time_str,
         'config_name' : corr.config_name,
-        'md5'    : corr.config_hash,
+        'hash'   : corr.config_hash,
+        'md5'    : helpers.config_md5(corr.config_str),
         }
     )
     
@@ -8,7 +8,7 @@ import sys
 import redis
 import argparse
 import time
-import hashlib
+from lwa_f.helpers import config_hash, config_md5
 
 parser = argparse.ArgumentParser(description='Config file to upload to redis',
                                  formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -24,6 +24,6 @@ r = redis.Redis(args.redishost)
 with open(args.config_file, 'r') as fh:
     upload_time = time.time()
     config = fh.read()
-    md5 = hashlib.md5(config.encode()).hexdigest()
-    r.hmset('lwa_configuration', {'config':config, 'md5':md5, 'name':fh.name,
+    r.hmset('lwa_configuration', {'config':config, 'hash':config_hash(config),
+                                  'md5':config_md5(config), 'name':fh.name,
                                   'upload_time':upload_time, 'upload_time_str':time.ctime(upload_time)})
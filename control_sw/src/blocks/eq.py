@@ -29,20 +29,23 @@ class Eq(Block):
         Inputs
            stream (int): Which stream to manipulate
            coeffs (list or numpy array): Coefficients to load.
+        Returns
+            numpy array of the coefficients actually loaded, after clipping and saturation.
         """
-        coeffs *= 2**self._BP
+        # Scale into a new array, rather than modifying the caller's coefficients
+        coeffs = np.asarray(coeffs) * 2**self._BP
         if np.any(coeffs > (2**self._WIDTH - 1)):
             self._warning("Some coefficients out of range")
         # Make integer
         coeffs = np.array(coeffs, dtype=np.int64)
         # saturate coefficients
         coeffs[coeffs>(2**self._WIDTH - 1)] = 2**self._WIDTH - 1
-        coeffs = list(coeffs)
         assert len(coeffs) == self.n_coeffs, "Length of provided coefficient vector should be %d" % self.n_coeffs
-        coeffs_str = struct.pack('>%d%s' % (len(coeffs), self._FORMAT), *coeffs)
+        coeffs_str = struct.pack('>%d%s' % (len(coeffs), self._FORMAT), *coeffs.tolist())
         coeff_reg = 'core%d_coeffs' % (stream // 16)
         stream_sub_index = stream % 16
         self.write(coeff_reg, coeffs_str, offset=self._stream_size * stream_sub_index)
+        return coeffs / (2.**self._BP)
 
     def get_coeffs(self, stream):
         """
@@ -1,3 +1,4 @@
+import struct
 from .block import Block
 
 class Eth(Block):
@@ -25,6 +26,24 @@ class Eth(Block):
         ip_offset = ip % 256
         self.write(self._CORE_NAME, mac_pack, offset=0x3000 + ip_offset*8)
 
+    def add_arp_entries(self, entries):
+        """
+        Set several arp entries.
+        `entries` is a dictionary of {ip: mac}. Entries for consecutive
+        IP addresses are written in a single transfer.
+        """
+        macs = {}
+        for ip, mac in entries.items():
+            macs[ip % 256] = mac
+        ip_offsets = sorted(macs)
+        start = 0
+        for i in range(1, len(ip_offsets) + 1):
+            if i == len(ip_offsets) or ip_offsets[i] != ip_offsets[i-1] + 1:
+                run = ip_offsets[start:i]
+                macs_pack = struct.pack('>%dQ' % len(run), *[macs[o] for o in run])
+                self.write(self._CORE_NAME, macs_pack, offset=0x3000 + run[0]*8)
+                start = i
+
     def get_status(self):
         #stat = self.read_uint('sw_txs_ss_status')
         rv = {}
@@ -6,6 +6,7 @@ import redis
 import json
 import socket
 import struct
+import hashlib
 
 
 logger = logging.getLogger(__name__)
@@ -40,6 +41,21 @@ class RedisHandler(logging.Handler):
             pass
 
             
+def config_hash(config_str):
+    """
+    Return a short hash of a configuration string, used to tell configurations apart.
+    Everything which publishes or compares configuration hashes should use this.
+    """
+    return hashlib.blake2b(config_str.encode(), digest_size=8).hexdigest()
+
+def config_md5(config_str):
+    """
+    Return the MD5 digest of a configuration string.
+    Deprecated in favour of `config_hash`, and only still published for
+    readers which haven't moved over to it yet.
+    """
+    return hashlib.md5(config_str.encode()).hexdigest()
+
 def log_notify(log, message=None):
     msg = message or "%s starting on %s" % (log.name, socket.gethostname())
     log.log(NOTIFY, msg)
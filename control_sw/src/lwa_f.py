@@ -2,12 +2,14 @@ import logging
 import os
 import time
 import socket
+import struct
 import redis
 import yaml
 import json
-import hashlib
+import operator
 from queue import Queue
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import numpy as np
 from casperfpga import utils
 from . import helpers
@@ -15,6 +17,16 @@ from .snap2_fengine import Snap2Fengine
 
 LOGGER = helpers.add_default_log_handlers(logging.getLogger(__name__))
 
+# Use the libyaml parser if PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# Format of EQ coefficients stored in redis. The hardware coefficients
+# are 16 bit, so are exactly representable.
+EQ_REDIS_DTYPE = '<f4'
+
 def _queue_instance_method(q, num, inst, method, args, kwargs):
     '''
     Add an [num, inst.method(*args, **kwargs)] call to queue, q.
@@ -25,6 +37,20 @@ def _queue_instance_method(q, num, inst, method, args, kwargs):
     '''
     q.put([num, getattr(inst, method)(*args, **kwargs)])
 
+def _instance_host(instance):
+    """
+    Return the hostname of a Snap2Fengine instance, or of the board on which
+    a block or CasperFpga instance lives.
+    """
+    host = instance.host
+    return host if isinstance(host, str) else host.host
+
+def _ip_to_int(ip):
+    """
+    Convert a dotted-quad IP address string to an integer.
+    """
+    return struct.unpack('>I', socket.inet_aton(ip))[0]
+
 class LwaF(object):
     def __init__(self, redishost='redishost', config=None, logger=LOGGER, passive=False, block_monitoring=True):
         """
@@ -39,14 +65,24 @@ class LwaF(object):
         """
         self.logger = logger
         self.redishost = redishost
-        self.r = redis.Redis(redishost)
+        # Keep the connection alive while idle, and check it before reusing it
+        # after more than 30 seconds, rather than failing on a stale socket
+        self.r = redis.Redis(redishost, socket_keepalive=True, health_check_interval=30)
         self.get_config(config)
 
         # Lists of connected Snap2Fengine objects
         self.fengs = []
+        # Dictionaries of connected Snap2Fengine objects, keyed by hostname and IP address
+        self.fengs_by_name = {}
+        self.fengs_by_ip = {}
         # Dictionary of {hostname: time (float)} where keys are hostnames
         # of dead boards and time entries are unix times when the host was declared dead
         self.dead_fengs = {}
+        # Redis key holding the monitoring daemon's status, once found by `is_monitoring`
+        self._monitor_status_key = None
+        # Worker threads used by `do_for_all_f`, created on first use
+        self._pool = None
+        self._pool_size = 0
         
         if not passive:
             if block_monitoring:
@@ -109,35 +145,75 @@ class LwaF(object):
         # Check if the method is callable. If so, call
         # if not, just get the attribute for all FEngines in a single-threaded manner
         if not callable(getattr(instances[0], method)):
-            for instance in instances:
-                if isinstance(instance.host, basestring):
-                    rv[instance.host] = instance.__getattribute__(method)
-                else:
-                    rv[instance.host.host] = instance.__getattribute__(method)
+            get = operator.attrgetter(method)
+            rv = {_instance_host(instance): get(instance) for instance in instances}
         else:
-            try:
-                x = utils.threaded_fpga_function(instances, timeout, (method, args, kwargs))
-                for x, val in x.iteritems():
-                    if not isinstance(x, basestring):
-                        host = x.host
-                    else:
-                        host = x
-                    rv[host] = val
-            except RuntimeError:
-                return None
+            pool = self._get_pool(len(instances))
+            futures = [(instance, pool.submit(getattr(instance, method), *args, **kwargs)) for instance in instances]
+            deadline = time.time() + timeout
+            for instance, future in futures:
+                try:
+                    val = future.result(timeout=max(0, deadline - time.time()))
+                except TimeoutError:
+                    # Don't leave hung calls occupying the workers of later calls
+                    self._discard_pool()
+                    return None
+                except Exception:
+                    self.logger.exception("Call to %s failed on %s" % (method, _instance_host(instance)))
+                    return None
+                rv[_instance_host(instance)] = val
 
         if dead_count_threshold is not None:
             # count dead engines
-            for feng in self.fengs:
-                if feng.host not in rv.keys():
-                    feng.error_count += 1
-                else:
+            for host in rv:
+                feng = self.fengs_by_name.get(host)
+                if feng is not None:
                     feng.error_count = 0
+            dead = []
+            for host in set(self.fengs_by_name).difference(rv):
+                feng = self.fengs_by_name[host]
+                feng.error_count += 1
                 if feng.error_count > dead_count_threshold:
                     self.logger.warning("Declaring %s dead after %d errors" % (feng.host, feng.error_count))
-                    self.declare_feng_dead(feng) 
+                    dead += [feng]
+            # Don't modify self.fengs while iterating over it
+            for feng in dead:
+                self.declare_feng_dead(feng)
         return rv
 
+    def declare_feng_dead(self, feng):
+        """
+        Stop using an F-Engine, and add it to `self.dead_fengs` so that
+        `reestablish_dead_connections` can later try to reconnect to it.
+        inputs:
+            feng (Snap2Fengine): F-Engine to declare dead
+        """
+        self.fengs = [f for f in self.fengs if f is not feng]
+        self.dead_fengs[feng.host] = time.time()
+        self.fengs_by_name.pop(feng.host, None)
+        self.fengs_by_ip.pop(getattr(feng, 'ip', None), None)
+
+    def _get_pool(self, n):
+        """
+        Get the thread pool used by `do_for_all_f`, making sure it has at least
+        `n` workers.
+        """
+        if self._pool_size < n:
+            self._discard_pool()
+            self._pool = ThreadPoolExecutor(max_workers=n)
+            self._pool_size = n
+        return self._pool
+
+    def _discard_pool(self):
+        """
+        Stop using the current `do_for_all_f` thread pool, without waiting
+        for any calls it is still running.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._pool = None
+        self._pool_size = 0
+
     def get_config(self, config=None):
         """
         Parse a configuration file.
@@ -145,20 +221,26 @@ class LwaF(object):
             config (str): Path to configuration file. If None, a configuration will be pulled from redis.
         """
         if config is None:
-            self.config_str  = self.r.hget('lwa_configuration', 'config')
-            self.config_name = self.r.hget('lwa_configuration', 'name')
-            self.config_hash = self.r.hget('lwa_configuration', 'md5')
-            self.config_time  = float(self.r.hget('lwa_configuration', 'upload_time'))
-            self.config_time_str  = self.r.hget('lwa_configuration', 'upload_time_str')
+            # Fetch all fields in a single round trip
+            redval = self.r.hgetall('lwa_configuration')
+            self.config_str  = redval[b'config'].decode()
+            self.config_name = redval[b'name'].decode()
+            if b'hash' in redval:
+                self.config_hash = redval[b'hash'].decode()
+            else:
+                # Configurations uploaded by older scripts don't carry a hash
+                self.config_hash = helpers.config_hash(self.config_str)
+            self.config_time  = float(redval[b'upload_time'])
+            self.config_time_str  = redval[b'upload_time_str'].decode()
             self.logger.info('Using configuration from redis, uploaded at %s' % self.config_time_str)
         else:
             with open(config, 'r') as fp:
                 self.config_str = fp.read()
             self.config_name = config
-            self.config_hash = hashlib.md5(self.config_str.encode()).hexdigest()
+            self.config_hash = helpers.config_hash(self.config_str)
             self.config_time = time.time()
             self.config_time_str = time.ctime(self.config_time)
-        self.config = yaml.load(self.config_str, Loader=yaml.SafeLoader)
+        self.config = yaml.load(self.config_str, Loader=YamlLoader)
 
     def establish_connections(self):
         """
@@ -185,11 +267,23 @@ class LwaF(object):
                 self.dead_fengs[host] = time.time()
         self.fengs_by_name = {}
         self.fengs_by_ip = {}
-        for feng in self.fengs:
-            feng.ip = socket.gethostbyname(feng.host)
+        self._add_feng_addresses(self.fengs)
+        self.logger.info('SNAPs are: %s' % ', '.join([feng.host for feng in self.fengs]))
+
+    def _add_feng_addresses(self, fengs):
+        """
+        Look up the IP address of each of the Snap2Fengine instances `fengs`,
+        and add them to the `fengs_by_name` and `fengs_by_ip` dictionaries.
+        """
+        if len(fengs) == 0:
+            return
+        # Each lookup blocks on DNS, so do them all at once
+        with ThreadPoolExecutor(max_workers=len(fengs)) as pool:
+            ips = list(pool.map(socket.gethostbyname, [feng.host for feng in fengs]))
+        for feng, ip in zip(fengs, ips):
+            feng.ip = ip
             self.fengs_by_name[feng.host] = feng
             self.fengs_by_ip[feng.ip] = feng
-        self.logger.info('SNAPs are: %s' % ', '.join([feng.host for feng in self.fengs]))
 
     def _try_to_connect(self, q, host, ant_indices, redishost):
         """
@@ -223,21 +317,40 @@ class LwaF(object):
             self.fengs += [feng]
         q.join()
         is_connected = self.do_for_all_f('is_connected', block = 'fpga')
+        alive = []
         for feng in self.fengs:
             if not is_connected.get(feng.host, False):
                 self.dead_fengs[feng.host] = time.time()
-                self.fengs.remove(feng)
                 self.logger.warning("Board %s is not connected" % feng.host)
             else:
                 feng.error_count = 0
+                alive += [feng]
+        self.fengs = alive
         self.fengs_by_name = {}
         self.fengs_by_ip = {}
-        for feng in self.fengs:
-            feng.ip = socket.gethostbyname(feng.host)
-            self.fengs_by_name[feng.host] = feng
-            self.fengs_by_ip[feng.ip] = feng
+        self._add_feng_addresses(self.fengs)
         self.logger.info('SNAPs are: %s' % ', '.join([feng.host for feng in self.fengs]))
 
+    def _try_to_reconnect(self, host, programmed_only=False):
+        """
+        Try to reconnect to a single dead SNAP. Used in a multithreaded manner
+        by `reestablish_dead_connections`.
+        Returns:
+            A connected Snap2Fengine instance, or None if the board can't be used.
+        """
+        try:
+            feng = Snap2Fengine(host)
+            if not feng.fpga.is_connected():
+                self.logger.info("Tried to reconnect to host %s and failed with 'not connected' response" % host)
+                return None
+            if programmed_only and not feng.is_programmed():
+                self.logger.info("Tried to reconnect to host %s. It is alive but not programmed." % host)
+                return None
+            return feng
+        except:
+            self.logger.exception("Tried to reconnect to host %s and failed with exception" % host)
+            return None
+
     def reestablish_dead_connections(self, age=0.0, programmed_only=False):
         """
         Try to reconnect to all boards in `self.dead_fengs`,
@@ -245,30 +358,25 @@ class LwaF(object):
         Is non-disruptive to connected boards.
         """
         t_thresh = time.time() - age # Try to connect to boards which were declared dead before this time
-        new_fengs = []
+        hosts = []
         for host, deadtime in self.dead_fengs.items():
             if deadtime > t_thresh:
-                self.logger.info("Ignoring host %s, which was only declared dead %d seconds ago" % (time.time() - deadtime))
+                self.logger.info("Ignoring host %s, which was only declared dead %d seconds ago" % (host, time.time() - deadtime))
                 continue
-            try:
-                feng = Snap2Fengine(host)
-                if feng.fpga.is_connected():
-                    if (not programmed_only) or (programmed_only and feng.is_programmed()):
-                        new_fengs += [feng]
-                        feng.error_count = 0
-                        self.dead_fengs.pop(host)
-                        self.logger.info("Tried to reconnect to host %s and succeeded!." % host)
-                    else:
-                        self.logger.info("Tried to reconnect to host %s. It is alive but not programmed." % host)
-                else:
-                    self.logger.info("Tried to reconnect to host %s and failed with 'not connected' response" % host)
-            except:
-                self.logger.exception("Tried to reconnect to host %s and failed with exception" % host)
+            hosts += [host]
+        new_fengs = []
+        if len(hosts) > 0:
+            # Try all the boards at once, so a reconnect takes as long as the slowest board
+            with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+                fengs = list(pool.map(self._try_to_reconnect, hosts, [programmed_only]*len(hosts)))
+            for host, feng in zip(hosts, fengs):
+                if feng is not None:
+                    new_fengs += [feng]
+                    feng.error_count = 0
+                    self.dead_fengs.pop(host)
+                    self.logger.info("Tried to reconnect to host %s and succeeded!." % host)
 
-        for feng in new_fengs:
-            feng.ip = socket.gethostbyname(feng.host)
-            self.fengs_by_name[feng.host] = feng
-            self.fengs_by_ip[feng.ip] = feng
+        self._add_feng_addresses(new_fengs)
         
         if len(new_fengs) > 0:
             self.logger.info('Re-established connections to SNAPs : %s' % ', '.join([feng.host for feng in new_fengs]))
@@ -289,11 +397,18 @@ class LwaF(object):
         if wait:
             TIMEOUT = 60
             start = time.time()
-            while self.is_monitoring():
-                if time.time() > (start + TIMEOUT):
-                    self.logger.warning("Timed out waiting for monitor to stop")
-                    return
-                time.sleep(1)
+            # If the redis server publishes keyspace notifications, wake up as soon as
+            # the monitor's status key changes. Otherwise, check once a second.
+            ps = self.r.pubsub(ignore_subscribe_messages=True)
+            ps.psubscribe('__keyspace@*__:status:*hera_snap_redis_monitor.py')
+            try:
+                while self.is_monitoring():
+                    if time.time() > (start + TIMEOUT):
+                        self.logger.warning("Timed out waiting for monitor to stop")
+                        return
+                    ps.get_message(timeout=1)
+            finally:
+                ps.close()
             return
         
     def enable_monitoring(self):
@@ -308,9 +423,16 @@ class LwaF(object):
         Note that a False return could either indicate either that the monitor
         is suspended or that it is not running at all.
         """
+        if self._monitor_status_key is not None:
+            state = self.r.get(self._monitor_status_key)
+            if state is not None:
+                return state == b"alive"
+            # The key has gone, so search for it again
+            self._monitor_status_key = None
         for key in self.r.scan_iter("status:*hera_snap_redis_monitor.py"):
+            self._monitor_status_key = key
             state = self.r.get(key)
-            return state == "alive"
+            return state == b"alive"
         # If we get here there was no status key and the monitor isn't running
         return False
 
@@ -348,8 +470,12 @@ class LwaF(object):
         self.logger.info("Actually programming %s" % ([f.host for f in self.fengs]))
         utils.program_fpgas([f.fpga for f in to_be_programmed], progfile, timeout=300.0)
         time.sleep(20)
+        # All the boards were programmed together, so share one timestamp
+        prog_time = time.ctime()
+        pipe = self.r.pipeline(transaction=False)
         for f in to_be_programmed:
-            self.r.hset('status:snap:%s' % f.host, 'last_programmed', time.ctime())
+            pipe.hset('status:snap:%s' % f.host, 'last_programmed', prog_time)
+        pipe.execute()
         
     def get_ant_snap_chan(self, ant, pol):
         """
@@ -361,20 +487,21 @@ class LwaF(object):
         Returns:
            (snap_instance [Snap2Fengine], channel_num [int])
         """
-        assert isinstance(ant, basestring), "`ant` input should be a string"
-        assert isinstance(pol, basestring), "`pol` input should be a string"
+        assert isinstance(ant, str), "`ant` input should be a string"
+        assert isinstance(pol, str), "`pol` input should be a string"
         pol = pol.lower()
         assert pol in ['e', 'n'], "`pol` input should be 'e' or 'n'"
-        if ant not in self.ant_to_snap.keys():
+        pols = self.ant_to_snap.get(ant)
+        if pols is None:
             self.logger.warning("Tried to find antenna %s but it is not on a known SNAP" % ant)
             return None, None
-        if pol not in self.ant_to_snap[ant]:
+        x = pols.get(pol)
+        if x is None:
             self.logger.warning("Tried to find antenna %s:%s but it is not on a known SNAP" % (ant, pol))
             return None, None
-        x = self.ant_to_snap[ant][pol]
         return x['host'], x['channel']
 
-    def set_eq(self, ant, pol, eq=None):
+    def set_eq(self, ant, pol, eq=None, verify=False):
         """
         Set the EQ coefficients of Antenna `ant`, polarization `pol` to
         a constant or vector `eq`.
@@ -384,6 +511,8 @@ class LwaF(object):
             eq: Float/Int coefficients. If a single number, all coefficients will be
                 set to this value. If a vector, each entry is one coefficient.
                 If None, an attempt will be made to load coefficients from redis.
+           verify: Boolean. If True, read the coefficients back from the board to
+                update redis. Otherwise, redis is updated with the values written.
         """
         snap, chan = self.get_ant_snap_chan(ant, pol)
         if snap is None:
@@ -397,10 +526,10 @@ class LwaF(object):
                # Try to reload coefficients from redis
                self.logger.debug("Trying to set coeffs for Ant %s%s from redis" % (ant, pol))
                redval = self.r.hgetall("eq:ant:%s:%s" % (ant, pol))
-               if redval != {}:
-                   self.logger.debug("Loading coeffs from time %s" % (time.ctime(float(redval['time']))))
-                   coeffs = np.array(json.loads(redval['values']))
-                   self.set_eq(ant, pol, coeffs)
+               if redval:
+                   self.logger.debug("Loading coeffs from time %s" % (time.ctime(float(redval[b'time']))))
+                   coeffs = self._eq_from_redis(redval)
+                   self.set_eq(ant, pol, coeffs, verify=verify)
                    return
                # If there are no coeffs in redis. Look at whatever is actually loaded and update redis
                else:
@@ -413,8 +542,11 @@ class LwaF(object):
                 except:
                     self.logger.error("Couldn't understand EQ coefficients!")
                     return
-            snap.eq.set_coeffs(chan, eq)
-            self.get_eq(ant, pol, update_redis=True)
+            coeffs = snap.eq.set_coeffs(chan, eq)
+            if verify:
+                self.get_eq(ant, pol, update_redis=True)
+            else:
+                self._persist_eq_to_redis(ant, pol, coeffs)
             
 
     def get_eq(self, ant, pol, update_redis=False):
@@ -438,19 +570,57 @@ class LwaF(object):
         else:
             coeffs = snap.eq.get_coeffs(chan)
         if update_redis:
-            self.r.hmset('eq:ant:%s:%s' % (ant, pol), {'values':json.dumps(coeffs.tolist()), 'time':time.time()})
+            self._persist_eq_to_redis(ant, pol, coeffs)
         return coeffs
 
+    def _persist_eq_to_redis(self, ant, pol, coeffs):
+        """
+        Store the EQ coefficients of Antenna `ant`, polarization `pol` in redis.
+        Inputs:
+           ant: Antenna string. Eg. '0', for HH0
+           pol: String polarization -- 'e' or 'n'
+           coeffs: EQ vector (numpy.array)
+        """
+        self.r.hset('eq:ant:%s:%s' % (ant, pol), mapping={'values':coeffs.astype(EQ_REDIS_DTYPE).tobytes(),
+                    'dtype':EQ_REDIS_DTYPE, 'time':time.time()})
+
+    def _eq_from_redis(self, redval):
+        """
+        Decode EQ coefficients stored in redis.
+        Inputs:
+           redval: Dictionary of an "eq:ant:<ant>:<pol>" hash, as returned by redis
+        Returns:
+           EQ vector (numpy.array)
+        """
+        if b'dtype' in redval:
+            # astype() copies, so the result is writable
+            return np.frombuffer(redval[b'values'], dtype=redval[b'dtype'].decode()).astype(float)
+        # Older entries are JSON lists
+        return np.array(json.loads(redval[b'values']))
+
     def _initialize_all_eq(self):
         """
         Initialize PAM attenuation and SNAP EQ settings to the values currently held in redis.
         """
+        antpols = []
         for feng in self.fengs:
             for antpol in feng.ants:
                 if antpol is not None:
-                   self.logger.info("Initializing EQ for %s" % antpol)
                    ant, pol = helpers.hera_antpol_to_ant_pol(antpol)
-                   self.set_eq(str(ant), pol)
+                   antpols += [(antpol, str(ant), pol)]
+        # Fetch all the stored coefficients in one round trip
+        pipe = self.r.pipeline(transaction=False)
+        for antpol, ant, pol in antpols:
+            pipe.hgetall("eq:ant:%s:%s" % (ant, pol))
+        redvals = pipe.execute()
+        for (antpol, ant, pol), redval in zip(antpols, redvals):
+            self.logger.info("Initializing EQ for %s" % antpol)
+            if redval:
+                self.set_eq(ant, pol, self._eq_from_redis(redval))
+            else:
+                # If there are no coeffs in redis. Look at whatever is actually loaded and update redis
+                self.logger.debug("Failed to find coefficients in redis!")
+                self.get_eq(ant, pol, update_redis=True)
 
     def _initialize_fft_shift(self):
         for feng in self.fengs:
@@ -493,8 +663,10 @@ class LwaF(object):
             self.logger.info('Initializing all hosts using multithreading')
             init_time = time.ctime()
             self.do_for_all_f("initialize", timeout=timeout)
+            pipe = self.r.pipeline(transaction=False)
             for feng in self.fengs:
-                self.r.hset('status:snap:%s' % feng.host, 'last_initialized', init_time)
+                pipe.hset('status:snap:%s' % feng.host, 'last_initialized', init_time)
+            pipe.execute()
         #TODO multithread these:
         self._initialize_fft_shift() 
         self._initialize_all_eq()
@@ -515,24 +687,29 @@ class LwaF(object):
         chans_per_packet = self.config.get('chans_per_packet', 384) # Hardcoded in firmware
         self.logger.info('Configuring frequency slots for %d X-engines, %d channels per packet' % (n_xengs, chans_per_packet))
         dest_port = self.config['dest_port'] 
-        self.r.delete("corr:snap_ants")
-        self.r.delete("corr:xeng_chans")
+        # Queue up the redis updates and send them together
+        pipe = self.r.pipeline(transaction=False)
+        pipe.delete("corr:snap_ants")
+        pipe.delete("corr:xeng_chans")
+        # Slot assignments and ARP entries for all X-engines, sent in one call per
+        # F-engine when multithreading
+        slots = []
+        arp_entries = {}
         for xn, xparams in self.config['xengines'].items():
             chan_range = xparams.get('chan_range', [xn*384, (xn+1)*384])
             chans = range(chan_range[0], chan_range[1])
-            self.r.hset("corr:xeng_chans", xn, json.dumps(chans))
+            pipe.hset("corr:xeng_chans", xn, json.dumps(chans))
             if (xn > n_xengs): 
                self.logger.error("Cannot have more than %d X-engs!!" % n_xengs)
+               pipe.execute()
                return False
-            ip = [int(i) for i in xparams['even']['ip'].split('.')]
-            ip_even = (ip[0]<<24) + (ip[1]<<16) + (ip[2]<<8) + ip[3]
-            ip = [int(i) for i in xparams['odd']['ip'].split('.')]
-            ip_odd = (ip[0]<<24) + (ip[1]<<16) + (ip[2]<<8) + ip[3]
+            ip_even = _ip_to_int(xparams['even']['ip'])
+            ip_odd = _ip_to_int(xparams['odd']['ip'])
 
             for fn, feng in enumerate(self.fengs):
                 self.logger.info('%s: Setting Xengine %d: chans %d-%d: %s (even) / %s (odd)' % (feng.fpga.host, xn, chans[0], chans[-1], xparams['even']['ip'], xparams['odd']['ip']))
                 # Update redis to reflect current assignments
-                self.r.hset("corr:snap_ants", feng.host, json.dumps(feng.ant_indices))
+                pipe.hset("corr:snap_ants", feng.host, json.dumps(feng.ant_indices))
                 # if the user hasn't specified a source port, auto increment mod 4
                 source_port = self.config['fengines'][feng.host].get('source_port', dest_port + (fn%4))
                 if not multithread:
@@ -540,10 +717,13 @@ class LwaF(object):
                     feng.packetizer.assign_slot(xn, chans, [ip_even,ip_odd], feng.reorder, feng.ant_indices[0])
                     feng.eth.add_arp_entry(ip_even,xparams['even']['mac'])
                     feng.eth.add_arp_entry(ip_odd,xparams['odd']['mac'])
-            else:
-                self.do_for_all_f("assign_slot", args=[xn, chans, [ip_even,ip_odd]])
-                self.do_for_all_f("add_arp_entry", block="eth", args=[ip_even, xparams['even']['mac']])
-                self.do_for_all_f("add_arp_entry", block="eth", args=[ip_odd, xparams['odd']['mac']])
+            if multithread:
+                slots += [(xn, chans, [ip_even,ip_odd])]
+                arp_entries[ip_even] = xparams['even']['mac']
+                arp_entries[ip_odd] = xparams['odd']['mac']
+        if multithread:
+            self.do_for_all_f("assign_slots", args=[slots])
+            self.do_for_all_f("add_arp_entries", block="eth", args=[arp_entries])
         if not multithread:
             for fn, feng in enumerate(self.fengs):
                 feng.eth.set_source_port(source_port)
@@ -551,6 +731,7 @@ class LwaF(object):
         else:
             self.do_for_all_f("set_source_port", block="eth", args=[source_port])
             self.do_for_all_f("set_port", block="eth", args=[dest_port])
+        pipe.execute()
         return True
 
     def resync(self, manual=False):
@@ -579,8 +760,8 @@ class LwaF(object):
         else:
             sync_time = int(before_sync) + 1 + 3 # Takes 3 PPS pulses to arm
         # Store sync time in ms!!!
-        self.r['corr:feng_sync_time'] = 1000*sync_time
-        self.r['corr:feng_sync_time_str'] = time.ctime(sync_time)
+        self.r.mset({'corr:feng_sync_time': 1000*sync_time,
+                     'corr:feng_sync_time_str': time.ctime(sync_time)})
         self.logger.info('Syncing took %.2f seconds' % (after_sync - before_sync))
         if after_sync - before_sync > 0.5:
             self.logger.warning("It took longer than expected to arm sync!")
@@ -617,8 +798,8 @@ class LwaF(object):
             self.logger.warning("It took longer than expected to arm sync!")
         # Update sync time -- in ms!!!!
         sync_time_ms = 1000*(int(time_before_arm) + 1 + 3) + delay_ms
-        self.r['corr:feng_sync_time'] = sync_time_ms
-        self.r['corr:feng_sync_time_str'] = time.ctime(sync_time_ms/1000.)
+        self.r.mset({'corr:feng_sync_time': sync_time_ms,
+                     'corr:feng_sync_time_str': time.ctime(sync_time_ms/1000.)})
         return sync_time_ms
 
     def sync_noise(self, manual=False):
@@ -70,6 +70,16 @@ class Snap2Fengine(object):
             block.initialize()
         self.initialized = True
 
+    def assign_slots(self, slots):
+        """
+        Assign several X-engine packet slots.
+        Inputs:
+            slots (list): List of (xeng_index, chans, ips) tuples, each as
+                          taken by `Packetizer.assign_slot`
+        """
+        for xn, chans, ips in slots:
+            self.packetizer.assign_slot(xn, chans, ips, self.reorder, self.ant_indices[0])
+
     def get_fpga_stats(self):
         """
         Get FPGA stats.